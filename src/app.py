@@ -1,6 +1,5 @@
 from flask import Flask, render_template, Response
-import cv2
-import time
+import threading
 from camera import VideoCamera
 
 app = Flask(__name__)
@@ -8,12 +7,18 @@ app = Flask(__name__)
 # Initialize camera (using a dummy source or the file initially for testing)
 # In production, this will use the RTSP stream or optimized capture
 video_camera = None
+_camera_lock = threading.Lock()
 
 def get_camera():
+    # Double-checked locking: Flask serves requests from multiple threads,
+    # and two clients hitting /video_feed at once must not each spin up a
+    # VideoCamera (duplicate capture + pipeline threads on the same source).
     global video_camera
     if video_camera is None:
-        # Defaulting to the local video file for development
-        video_camera = VideoCamera(source='video.mp4')
+        with _camera_lock:
+            if video_camera is None:
+                # Defaulting to the local video file for development
+                video_camera = VideoCamera(source='video.mp4')
     return video_camera
 
 @app.route('/')
@@ -45,5 +50,7 @@ def toggle_pause():
     return {'paused': is_paused}
 
 if __name__ == '__main__':
-    # HACK: Using 0.0.0.0 to be accessible, debug=True for dev
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Dev server only — production runs via gunicorn, see wsgi.py.
+    # debug=True is gone: the reloader would double-initialize the camera
+    # pipeline and its stat loop steals CPU from encoding.
+    app.run(host='0.0.0.0', port=5000, threaded=True)
@@ -1,106 +1,459 @@
 import cv2
 import time
 import threading
+import queue
+import functools
+import traceback
 import numpy as np
 from detector import YOLOProcessor
-from filters import calculate_entropy, detect_specular_highlight
+import filters
+from filters import analyze_rois
 import os
 
+# TurboJPEG (libjpeg-turbo) encodes roughly 3-5x faster than the libjpeg
+# bundled with OpenCV thanks to SIMD DCT/Huffman paths. It's an optional
+# dependency; we fall back to cv2.imencode when it's not installed.
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+@functools.lru_cache(maxsize=8)
+def _resolve_source(source):
+    """
+    Maps a source argument to something cv2.VideoCapture can open.
+
+    Webcam indices and RTSP urls pass through; for file paths we also try
+    the repo root (development convenience). Cached so reconnect logic that
+    recreates VideoCamera on the same source skips the stat() probing.
+    """
+    if isinstance(source, str) and not source.startswith('rtsp') and not os.path.exists(source):
+        candidate = os.path.join(os.path.dirname(__file__), '..', source)
+        if os.path.exists(candidate):
+            return candidate
+    return source
+
+@functools.lru_cache(maxsize=1)
+def _resolve_model_path():
+    """
+    Locates the ALPHA.pt weights (repo layout first, cwd as fallback).
+    Resolved once per process.
+    """
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'ALPHA.pt'))
+    if not os.path.exists(path):
+        # Fallback to current dir or specific location if needed
+        path = 'ALPHA.pt'
+    return path
+
 class VideoCamera(object):
     def __init__(self, source='video.mp4', model_path='../../ALPHA.pt'):
         # Open video source
         # source can be an integer (webcam index) or a string (video file/RTSP url)
-        # Attempt to handle relative path for video if it's a file
-        if isinstance(source, str) and not source.startswith('rtsp') and not os.path.exists(source):
-             # periodic check for file in parent dir if not found (development convenience)
-             if os.path.exists(os.path.join(os.path.dirname(__file__), '..', source)):
-                 source = os.path.join(os.path.dirname(__file__), '..', source)
+        source = _resolve_source(source)
+
+        # Ask FFmpeg for hardware-accelerated decode (NVDEC on NVIDIA, VAAPI
+        # on Intel/AMD). H.264 decode then runs on the dedicated ASIC instead
+        # of burning a CPU core per stream. VIDEO_ACCELERATION_ANY lets
+        # OpenCV fall back to software decode internally when no hw decoder
+        # matches the codec, so this is safe on any host.
+        self.video = None
+        if isinstance(source, str):
+            try:
+                self.video = cv2.VideoCapture(source, cv2.CAP_FFMPEG,
+                                              [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+                                               cv2.CAP_PROP_HW_DEVICE, 0])
+                if self.video.isOpened():
+                    accel = int(self.video.get(cv2.CAP_PROP_HW_ACCELERATION))
+                    if accel != cv2.VIDEO_ACCELERATION_NONE:
+                        print(f"Video decode using hardware acceleration (mode {accel})")
+            except cv2.error:
+                self.video = None
+
+        if self.video is None or not self.video.isOpened():
+            # Webcam index, or an OpenCV build that rejects the hwaccel params
+            self.video = cv2.VideoCapture(source)
 
-        self.video = cv2.VideoCapture(source)
-        
         if not self.video.isOpened():
             raise ValueError(f"Unable to open video source: {source}")
 
+        # Live sources (webcam index, RTSP/HTTP url) deliver frames at their
+        # own pace: if inference stalls, buffered frames pile up and the
+        # stream drifts seconds behind reality. Keep OpenCV's internal
+        # buffer at a single frame and let the reader drop stale frames so
+        # end-to-end latency stays bounded. File playback keeps every frame.
+        self._is_live = not (isinstance(source, str) and os.path.exists(source))
+        if self._is_live:
+            self.video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._dropped = 0
+        self._drop_log_ts = time.time()
+
         # Initialize Detector
         # Model path is likely in ../../data/ALPHA.pt or relative to execution
         # Adjusting path assumption based on project structure: /home/alpha/ALPHA_PY/final/ALPHA.pt
-        real_model_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'ALPHA.pt'))
-        if not os.path.exists(real_model_path):
-             # Fallback to current dir or specific location if needed
-             real_model_path = 'ALPHA.pt'
-        
+        real_model_path = _resolve_model_path()
+
         print(f"Initializing Detector with model: {real_model_path}")
         self.detector = YOLOProcessor(model_path=real_model_path, conf_thres=0.4)
+
+        # Pay the one-off Numba JIT compile (if installed) here instead of
+        # on the first streamed frame
+        filters.warmup()
+
+        # Filled from the detector's precomputed class-name lookups on the
+        # first processed frame (the model itself loads lazily)
+        self._lower_names = None
+        self._is_person = None
+
+        # GPU filter path: when the detector runs on CUDA anyway, entropy
+        # and glare are computed from a single on-device grayscale upload
+        self._gpu_filters = filters.torch is not None and self.detector.device == 'cuda'
+
+        # Scratch buffer for the CPU filter path's grayscale conversions,
+        # sized to the frame on first use
+        self._gray_scratch = None
         
         
         self.paused = False
         self.last_frame = None
-        
+
+        # One shared TurboJPEG handle for the encoder thread (encode() is
+        # thread-safe on a single instance). None -> cv2.imencode fallback.
+        self._jpeg = None
+        if TurboJPEG is not None:
+            try:
+                self._jpeg = TurboJPEG()
+                print("Using TurboJPEG for stream encoding")
+            except Exception as e:
+                print(f"TurboJPEG unavailable ({e}), using cv2.imencode")
+
         # History Memory: { track_id: {'glare_seen': bool, 'frames': int, 'buffer': []} }
         self.track_history = {}
+        # ByteTrack hands out fresh IDs forever, so track_history would grow
+        # without bound over a long session (and drag RSS + dict lookups with
+        # it). Track when each ID was last seen and sweep stale ones out
+        # periodically — the glare latch only matters while the object is
+        # still being tracked anyway.
+        self._gc_counter = 0
+        self._last_seen = {}
+
+        # Temporal subsampling: phones barely move between consecutive frames
+        # at ~30 FPS, so running YOLO on every frame wastes GPU time. We run
+        # real inference every detect_every frames; the frames in between
+        # reuse the last boxes but still get the cheap entropy/glare pass.
+        self.detect_every = 3
+        self._frame_idx = 0
+        self._last_dets = np.empty((0, 7), dtype=np.float32)
+
+        # Micro-batching: whenever the reader has run ahead, the inference
+        # thread grabs up to batch_size queued frames and submits the ones
+        # due for detection as a single tracked call, amortizing per-call
+        # Python/launch overhead. Kept small so worst-case added latency
+        # stays a few frame intervals.
+        self.batch_size = 4
+
+        # T-API: when an OpenCL device is around, draw the overlays on a
+        # cv2.UMat so rectangles/glyphs are rasterized on the GPU instead of
+        # burning CPU memory bandwidth, then copy the result back once.
+        self._use_ocl = cv2.ocl.haveOpenCL()
+        if self._use_ocl:
+            print("OpenCL available, drawing overlays via T-API")
+
+        # --- THREADED PIPELINE ---
+        # Decode, inference and JPEG encode each block a different resource
+        # (disk/network, GPU, CPU), so running them serially means each stage
+        # idles while the others work. Three threads with small bounded
+        # queues overlap the stages: reader -> _read_q -> inference ->
+        # _enc_q -> encoder -> _out_q -> get_frame. The bounded queues give
+        # natural backpressure so we never buffer more than a few frames.
+        self._stop = threading.Event()
+        self._read_q = queue.Queue(maxsize=4)
+        self._enc_q = queue.Queue(maxsize=4)
+        self._out_q = queue.Queue(maxsize=4)
+        self._reader_thread = threading.Thread(target=self._reader, daemon=True)
+        self._inference_thread = threading.Thread(target=self._inference, daemon=True)
+        self._encoder_thread = threading.Thread(target=self._encoder, daemon=True)
+        self._reader_thread.start()
+        self._inference_thread.start()
+        self._encoder_thread.start()
 
     def __del__(self):
+        # __init__ may have raised before the pipeline attributes exist
+        # (e.g. the unopenable-source ValueError above); release whatever
+        # did get created instead of dying with an AttributeError here.
+        if getattr(self, '_stop', None) is None:
+            video = getattr(self, 'video', None)
+            if video is not None:
+                video.release()
+            return
+        self._stop.set()
+        # Give the stages a moment to notice the event before yanking the
+        # capture out from under the reader (releasing mid-read can crash
+        # some FFmpeg backends). Daemon threads, so a timeout is enough.
+        for t in (self._reader_thread, self._inference_thread, self._encoder_thread):
+            if t.is_alive():
+                t.join(timeout=1.0)
         self.video.release()
-        
+
     def toggle_pause(self):
         self.paused = not self.paused
         return self.paused
 
+    def _put(self, q, item):
+        # put with a timeout loop so a blocked stage still notices _stop
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _reader(self):
+        """Decode thread: keeps the read queue topped up."""
+        while not self._stop.is_set():
+            # Same log-and-continue policy as the other stages: a cv2.error
+            # out of read()/set() (flaky RTSP via the FFmpeg backend) must
+            # not kill the thread, or the stream freezes with no log line.
+            try:
+                success, image = self.video.read()
+                if not success:
+                    # Loop video for testing purposes if it's a file
+                    self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    success, image = self.video.read()
+                    if not success:
+                        time.sleep(0.1)
+                        continue
+            except Exception as e:
+                print(f"Reader stage error ({e}), retrying")
+                time.sleep(0.1)
+                continue
+            if self._is_live:
+                # Drain-to-latest: never block on a full queue. Evict the
+                # oldest queued frame so inference always sees fresh input.
+                try:
+                    self._read_q.put_nowait(image)
+                except queue.Full:
+                    try:
+                        self._read_q.get_nowait()
+                        self._dropped += 1
+                    except queue.Empty:
+                        pass
+                    try:
+                        self._read_q.put_nowait(image)
+                    except queue.Full:
+                        self._dropped += 1
+                now = time.time()
+                if self._dropped and now - self._drop_log_ts >= 1.0:
+                    print(f"Capture: dropped {self._dropped} stale frame(s) in the last second")
+                    self._dropped = 0
+                    self._drop_log_ts = now
+            else:
+                # File playback: block (backpressure) so no frame is lost
+                self._put(self._read_q, image)
+
+    def _inference(self):
+        """Inference thread: pops raw frames, runs detection + drawing."""
+        while not self._stop.is_set():
+            # Block for the first frame, then sweep up whatever else the
+            # reader has queued (up to batch_size) without waiting.
+            try:
+                frames = [self._read_q.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(frames) < self.batch_size:
+                try:
+                    frames.append(self._read_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            # A transient failure (decoder hiccup, model error) must not
+            # kill the thread: log, drop this batch and keep consuming, or
+            # get_frame() would time out forever on a silently dead stage.
+            try:
+                # Only frames on the detect_every grid pay for inference; the
+                # rest reuse cached overlays (see _process_frame).
+                due = [i for i in range(len(frames))
+                       if (self._frame_idx + i) % self.detect_every == 0]
+                if due:
+                    batch_dets = self.detector.detect_batch([frames[i] for i in due])
+                    dets_by_index = dict(zip(due, batch_dets))
+                else:
+                    dets_by_index = {}
+
+                for i, image in enumerate(frames):
+                    # Frames without an inference slot reuse the boxes from the
+                    # last real inference; the cheap filters still run on the
+                    # fresh pixels so glare latching and labels stay current.
+                    self._process_frame(image, dets_by_index.get(i, self._last_dets))
+                    self._put(self._enc_q, image)
+            except Exception as e:
+                print(f"Inference stage error ({e}), dropping {len(frames)} frame(s)")
+                traceback.print_exc()
+            self._frame_idx += len(frames)
+
+    def _encoder(self):
+        """Encode thread: JPEG-compresses annotated frames for streaming."""
+        while not self._stop.is_set():
+            try:
+                image = self._enc_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # quality 75: visually fine for a surveillance feed, and it
+            # roughly halves both encode time and bytes on the wire vs the
+            # encoder defaults (cv2 uses 95)
+            try:
+                if self._jpeg is not None:
+                    data = self._jpeg.encode(image, quality=75)
+                else:
+                    ret, jpeg = cv2.imencode('.jpg', image,
+                                             [cv2.IMWRITE_JPEG_QUALITY, 75])
+                    data = jpeg.tobytes()
+            except Exception as e:
+                print(f"Encoder stage error ({e}), dropping frame")
+                continue
+            self._put(self._out_q, data)
+
     def get_frame(self):
         if self.paused and self.last_frame is not None:
              # Just return the previous frame to simulate pause
              # We add a small sleep to prevent busy-looping cpu spike
+             # (the queues fill up behind us, which parks the pipeline too)
              time.sleep(0.03)
              return self.last_frame
-             
-        success, image = self.video.read()
-        if not success:
-            # Loop video for testing purposes if it's a file
-            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            success, image = self.video.read()
-            if not success:
-                return None
-        
+
+        # Bridge the thread world to the greenlet world: under gevent
+        # (wsgi.py) queue.Queue is deliberately left unpatched
+        # (thread=False), so a blocking get(timeout=2.0) would park the
+        # worker's only OS thread and stall the hub — freezing every other
+        # viewer and route for up to 2s per iteration (worst during the
+        # first-run TensorRT build, when the queue stays empty for minutes).
+        # time.sleep IS patched, so polling with short naps yields to the
+        # hub; under the dev server's real threads it's just a 10ms nap.
+        deadline = time.time() + 2.0
+        while True:
+            try:
+                self.last_frame = self._out_q.get_nowait()
+                return self.last_frame
+            except queue.Empty:
+                if time.time() >= deadline:
+                    return None
+                time.sleep(0.01)
+
+    # Draw constants hoisted out of the per-box calls
+    _FONT = cv2.FONT_HERSHEY_SIMPLEX
+    _FONT_SCALE = 0.5
+
+    def _draw_overlays(self, image, overlays):
+        if not overlays:
+            return
+        target = cv2.UMat(image) if self._use_ocl else image
+        # Only three colors ever occur (person/calculator/phone); grouping
+        # by color lets each inner loop run with identical rectangle and
+        # text arguments, so OpenCV re-marshals the color/thickness tuple
+        # once per group instead of once per box.
+        by_color = {}
+        for (pt1, pt2, label, color) in overlays:
+            by_color.setdefault(color, []).append((pt1, pt2, label))
+        for color, items in by_color.items():
+            for (pt1, pt2, _) in items:
+                cv2.rectangle(target, pt1, pt2, color, 2)
+            for (pt1, _, label) in items:
+                cv2.putText(target, label, (pt1[0], pt1[1] - 10),
+                            self._FONT, self._FONT_SCALE, color, 2)
+        if self._use_ocl:
+            # One download back into the caller's buffer
+            image[:] = target.get()
+
+    def _process_frame(self, image, detections):
         # --- DETECTION PIPELINE ---
-        # 1. Detect Objects (Now with Tracking IDs)
-        # Returns: [x1, y1, x2, y2, conf, cls, track_id]
-        detections = self.detector.detect(image)
-        class_names = self.detector.names
-        
-        # 2. Process Detections
-        for x1, y1, x2, y2, conf, cls, track_id in detections:
-            # ROI (Region of Interest)
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-            
-            # Ensure coordinates are within image bounds
-            h, w, _ = image.shape
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(w, x2), min(h, y2)
-            
-            if x2 <= x1 or y2 <= y1:
-                continue
-            
+        # detections: [x1, y1, x2, y2, conf, cls, track_id] per row
+        # Cache the detector's precomputed class lookups on first use (the
+        # model is lazily loaded, so these only exist after a detect call)
+        if self._is_person is None:
+            self._is_person = self.detector._is_person
+            self._lower_names = self.detector._lower_names
+        overlays = []
+
+        # 2. Clamp the whole box matrix to image bounds in one shot: two
+        # vectorized clips plus one validity mask replace the ~8 Python
+        # max/min/int calls and the degenerate-box branch per detection.
+        h, w, _ = image.shape
+        if len(detections):
+            xy = detections[:, :4].astype(np.int32)
+            xy[:, 0::2] = np.clip(xy[:, 0::2], 0, w)
+            xy[:, 1::2] = np.clip(xy[:, 1::2], 0, h)
+            valid = (xy[:, 2] > xy[:, 0]) & (xy[:, 3] > xy[:, 1])
+            detections = detections[valid]
+            xy = xy[valid]
+        else:
+            xy = np.empty((0, 4), dtype=np.int32)
+
+        # 3. First pass: split people from objects, gather ROIs
+        candidates = []
+        for (x1, y1, x2, y2), det in zip(xy, detections):
+            conf = det[4]
+            cls, track_id = int(det[5]), int(det[6])
+
             # Identify Class
-            label_name = class_names.get(cls, str(cls)).lower()
-            
+            label_name = self._lower_names.get(cls, str(cls))
+
             # --- SPECIAL CASE: PERSON ---
-            if 'person' in label_name or 'human' in label_name:
+            if self._is_person.get(cls, False):
                 # Just draw a Blue box for people, no math analysis needed.
-                cv2.rectangle(image, (x1, y1), (x2, y2), (255, 0, 0), 2) # Blue
-                cv2.putText(image, f"Person {conf:.2f}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+                overlays.append(((x1, y1), (x2, y2), f"Person {conf:.2f}", (255, 0, 0))) # Blue
                 continue
-                
-            roi = image[y1:y2, x1:x2]
-            
-            # 3. Apply Filters (The "Calculator Test") with MEMORY
-            entropy = calculate_entropy(roi)
-            glare_score, has_glare = detect_specular_highlight(roi)
-            is_shiny_now = glare_score > 0.005
+
+            cand = {'box': (x1, y1, x2, y2),
+                    'track_id': track_id, 'label_name': label_name}
+            if not self._gpu_filters:
+                # CPU path only: the GPU path crops its own views from the
+                # uploaded grayscale frame by box coords, so slicing and
+                # resizing here would just be thrown away.
+                roi = image[y1:y2, x1:x2]
+                # Entropy and glare-ratio are statistics of the intensity
+                # distribution, which survives a 2x downsample. On big ROIs
+                # the filters are memory-bound, so halving each side cuts the
+                # bytes touched 4x. INTER_AREA averages blocks, keeping the
+                # histogram shape close enough that the entropy > 5.5 cut
+                # still holds. (The GPU path histograms full-resolution
+                # crops on purpose: device bandwidth makes the extra pixels
+                # cheaper than a resize kernel per ROI.)
+                if roi.size > 10_000:
+                    roi = cv2.resize(roi, (0, 0), fx=0.5, fy=0.5,
+                                     interpolation=cv2.INTER_AREA)
+                cand['roi'] = roi
+            candidates.append(cand)
+
+        # 4. Apply Filters (The "Calculator Test") with MEMORY
+        # Entropy + glare for all ROIs from one fused histogram pass each.
+        # With a CUDA detector the frame goes up once and the filters run
+        # next to the model; otherwise the CPU (Numba/NumPy) path is used.
+        if candidates:
+            if self._gpu_filters:
+                gray_gpu = filters.upload_gray(image, self.detector.device)
+                entropies, bright_ratios = filters.analyze_rois_gpu(
+                    gray_gpu, [c['box'] for c in candidates])
+            else:
+                # Reuse one grayscale scratch buffer across all ROIs/frames
+                if self._gray_scratch is None or self._gray_scratch.shape[:2] != (h, w):
+                    self._gray_scratch = np.empty((h, w), np.uint8)
+                entropies, bright_ratios = analyze_rois([c['roi'] for c in candidates],
+                                                        scratch=self._gray_scratch)
+        else:
+            entropies = bright_ratios = []
+
+        for entropy, bright_ratio, cand in zip(entropies, bright_ratios, candidates):
+            (x1, y1, x2, y2) = cand['box']
+            track_id = cand['track_id']
+            label_name = cand['label_name']
+
+            is_shiny_now = bright_ratio > 0.005
             
             # Update History if we have a valid ID
             if track_id != -1:
                 if track_id not in self.track_history:
                     self.track_history[track_id] = {'glare_seen': False, 'frames': 0}
+                self._last_seen[track_id] = self._gc_counter
                 
                 # If we see glare NOW, perform a "Latch" -> It's a phone forever (or for a long time)
                 if is_shiny_now:
@@ -133,11 +486,16 @@ class VideoCamera(object):
                 reason = "G-Mem" if is_confirmed_phone else "L-Ent"
                 label = f"#{track_id} {label_name} {reason} E:{entropy:.1f}"
             
-            # Draw Box
-            cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-        
-        # Encode for streaming
-        ret, jpeg = cv2.imencode('.jpg', image)
-        self.last_frame = jpeg.tobytes()
-        return self.last_frame
+            overlays.append(((x1, y1), (x2, y2), label, color))
+
+        # 5. Prune stale track memory every 300 inference frames
+        self._gc_counter += 1
+        if self._gc_counter % 300 == 0:
+            stale = [k for k, v in self._last_seen.items() if self._gc_counter - v > 600]
+            for k in stale:
+                self.track_history.pop(k, None)
+                self._last_seen.pop(k, None)
+
+        # 6. Draw, and cache the boxes for the skipped frames
+        self._last_dets = detections
+        self._draw_overlays(image, overlays)
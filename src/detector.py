@@ -1,50 +1,281 @@
 from ultralytics import YOLO
 import torch
+import threading
 import cv2
+import numpy as np
+import os
 
 class YOLOProcessor:
     def __init__(self, model_path, conf_thres=0.5):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f"Loading YOLOv8 model from {model_path} to {self.device}...")
-        
-        try:
-            self.model = YOLO(model_path)
-            # Warmup
-            # self.model.warmup(imgsz=(640, 640))
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise e
-            
+        self.model_path = model_path
         self.conf_thres = conf_thres
-    
+        # FP16 inference on CUDA: tensor-core GEMMs run ~2x faster than FP32
+        # and activations take half the memory bandwidth. The TRT engine is
+        # already built half=True; this flag makes the PyTorch .pt fallback
+        # path use FP16 too. Harmless no-op on CPU.
+        self.half = self.device == 'cuda'
+        # Inference resolution. The TRT engine is built at a fixed 640, and
+        # pre-shrinking here is cheaper than letting ultralytics letterbox a
+        # full native-resolution frame on the CPU first.
+        self.imgsz = 640
+        # Engines are exported with a dynamic batch axis up to this size so
+        # detect_batch() can submit micro-batches (the camera sweeps up to 4
+        # frames at a time; 8 leaves headroom). A static batch=1 engine would
+        # hard-assert on any multi-frame submission in AutoBackend.
+        self.max_batch = 8
+
+        # Lazy loading: deserializing (or worse, building) a TRT engine can
+        # take seconds to minutes, so constructing the processor no longer
+        # touches the model at all. The first frame loads it under a lock.
+        self.model = None
+        self._load_lock = threading.Lock()
+        # Per-class string lookups, filled in at model load (see below)
+        self._lower_names = None
+        self._is_person = None
+
+        # Pinned staging buffer + side stream for batched uploads, allocated
+        # on first use (CUDA only, see _preprocess_batch)
+        self._pinned = None
+        self._copy_stream = None
+
+    def _ensure_model(self):
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            model_path = self._prepare_model(self.model_path)
+            print(f"Loading YOLOv8 model from {model_path} to {self.device}...")
+            try:
+                if model_path.endswith('.engine'):
+                    # Engine files carry no task metadata; be explicit so
+                    # ultralytics doesn't have to guess the head type.
+                    self.model = YOLO(model_path, task='detect')
+                else:
+                    self.model = YOLO(model_path)
+                # Warmup
+                # self.model.warmup(imgsz=(640, 640))
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                raise e
+
+            # Precompute the per-class string work so the per-box hot loop
+            # never calls .lower() or substring-scans: class ids are a small
+            # fixed set, so both lookups collapse to one dict hit.
+            self._lower_names = {k: str(v).lower() for k, v in self.model.names.items()}
+            self._is_person = {k: ('person' in v or 'human' in v)
+                               for k, v in self._lower_names.items()}
+
+    def _engine_path(self, precision):
+        # TRT engines are specialized per GPU architecture and input shape —
+        # an engine built on one card won't deserialize on another. Encode
+        # (compute capability, imgsz, precision) in the filename so swapping
+        # GPUs triggers a rebuild instead of a load failure.
+        major, minor = torch.cuda.get_device_capability()
+        return (f"{self.model_path[:-3]}_sm{major}{minor}_{self.imgsz}"
+                f"_b{self.max_batch}_{precision}.engine")
+
+    def _shrink(self, frame):
+        """
+        Downscales a frame so its long side matches self.imgsz.
+
+        Ultralytics would resize internally anyway, but only after copying
+        the full native-resolution frame through its letterbox path. Doing a
+        single cv2.resize up front cuts that preprocessing cost; the caller
+        divides returned boxes by the scale to get back to source coords.
+        """
+        h, w = frame.shape[:2]
+        scale = self.imgsz / max(h, w)
+        if scale >= 1.0:
+            return frame, 1.0
+        small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_LINEAR)
+        return small, scale
+
+    def _prepare_model(self, model_path):
+        """
+        Prefer a TensorRT FP16 engine over the raw .pt weights.
+
+        TensorRT fuses conv+BN+activation and picks FP16 tensor-core kernels
+        for this GPU, so per-frame inference drops roughly 2-3x vs FP32
+        PyTorch eager mode. The export is a one-shot step: we build the
+        .engine file next to the weights the first time and reuse it on
+        every later run. CPU-only hosts just keep the .pt path (TensorRT
+        requires CUDA).
+        """
+        if self.device != 'cuda' or not model_path.endswith('.pt'):
+            return model_path
+
+        # INT8 beats FP16 by roughly 2x on Turing+ (IMMA/DP4A paths) at ~1
+        # point of mAP, but it needs calibration data. If the user dropped a
+        # calib.yaml next to the weights (a dataset yaml pointing at ~500
+        # representative classroom frames), build an int8 engine; otherwise
+        # stick to the plain FP16 build. TensorRT keeps its calibration
+        # cache next to the engine, so rebuilds skip the calibration pass.
+        calib_yaml = os.path.join(os.path.dirname(model_path) or '.', 'calib.yaml')
+        if os.path.exists(calib_yaml):
+            int8_path = self._engine_path('int8')
+            if not os.path.exists(int8_path):
+                try:
+                    print(f"Exporting {model_path} to TensorRT INT8 engine (calibrating, may take a while)...")
+                    YOLO(model_path).export(format='engine', int8=True, data=calib_yaml,
+                                            imgsz=self.imgsz, dynamic=True, batch=self.max_batch,
+                                            workspace=4, device=0)
+                    # Ultralytics writes <weights>.engine; move it to the
+                    # arch/precision-specific cache name.
+                    if os.path.exists(model_path[:-3] + '.engine'):
+                        os.replace(model_path[:-3] + '.engine', int8_path)
+                except Exception as e:
+                    print(f"INT8 export failed ({e}), trying FP16 instead")
+            if os.path.exists(int8_path):
+                return int8_path
+
+        engine_path = self._engine_path('fp16')
+        if not os.path.exists(engine_path):
+            try:
+                print(f"Exporting {model_path} to TensorRT FP16 engine (one-time, may take a while)...")
+                YOLO(model_path).export(format='engine', half=True, imgsz=self.imgsz,
+                                        dynamic=True, batch=self.max_batch, workspace=4, device=0)
+                if os.path.exists(model_path[:-3] + '.engine'):
+                    os.replace(model_path[:-3] + '.engine', engine_path)
+            except Exception as e:
+                # No TensorRT / export failed -> stay on the PyTorch weights
+                print(f"TensorRT export failed ({e}), falling back to {model_path}")
+                return model_path
+
+        return engine_path if os.path.exists(engine_path) else model_path
+
     @property
     def names(self):
+        self._ensure_model()
         return self.model.names
 
+    def _extract(self, r, scale):
+        """
+        Pulls all boxes of one result off the GPU in bulk.
+
+        Iterating result.boxes converts tensor->scalar per attribute per
+        box, i.e. several synchronizing D2H copies per detection. Fetching
+        xyxy/conf/cls/id as whole arrays is one contiguous copy each.
+        """
+        boxes = r.boxes
+        n = len(boxes)
+        if n == 0:
+            return np.empty((0, 7), dtype=np.float32)
+        xyxy = boxes.xyxy.cpu().numpy() / scale
+        conf = boxes.conf.cpu().numpy()
+        cls = boxes.cls.cpu().numpy()
+        if boxes.id is not None:
+            ids = boxes.id.cpu().numpy()
+        else:
+            ids = np.full(n, -1.0, dtype=conf.dtype)
+        return np.concatenate([xyxy, conf[:, None], cls[:, None], ids[:, None]],
+                              axis=1).astype(np.float32)
+
     def detect(self, frame):
         """
         Runs inference (Tracking) on a single frame.
-        Returns list of detections: [x1, y1, x2, y2, conf, cls, track_id]
+        Returns an (N, 7) float32 array, one detection per row:
+        [x1, y1, x2, y2, conf, cls, track_id]  (track_id is -1 if untracked)
         """
+        self._ensure_model()
+
         # Run inference with Tracking
         # persist=True is crucial for video tracking
-        results = self.model.track(frame, persist=True, tracker="bytetrack.yaml", conf=self.conf_thres, verbose=False)
-        
-        detections = []
-        
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                # Bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                conf = float(box.conf[0].cpu().numpy())
-                cls = int(box.cls[0].cpu().numpy())
-                
-                # Get Track ID if available
-                id = -1
-                if box.id is not None:
-                    id = int(box.id[0].cpu().numpy())
-                
-                detections.append([x1, y1, x2, y2, conf, cls, id])
-                
-        return detections
+        small, scale = self._shrink(frame)
+        results = self.model.track(small, persist=True, tracker="bytetrack.yaml", conf=self.conf_thres,
+                                   half=self.half, verbose=False)
+
+        parts = [self._extract(r, scale) for r in results]
+        if not parts:
+            return np.empty((0, 7), dtype=np.float32)
+        return np.concatenate(parts)
+
+    def detect_batch(self, frames):
+        """
+        Runs inference (Tracking) on a list of consecutive frames in one call.
+
+        A single model.track() over N frames amortizes the per-call Python
+        and CUDA launch overhead that dominates batch=1 inference, so the
+        GPU stays fed. Frames must be in capture order so the tracker state
+        advances correctly.
+
+        Returns a list with one (N, 7) float32 array per input frame, rows
+        laid out as in detect().
+        """
+        self._ensure_model()
+
+        # The engine's dynamic batch axis tops out at max_batch; split
+        # anything larger so the TRT backend never sees an oversized input.
+        if len(frames) > self.max_batch:
+            out = []
+            for i in range(0, len(frames), self.max_batch):
+                out.extend(self.detect_batch(frames[i:i + self.max_batch]))
+            return out
+
+        if self.device == 'cuda':
+            # Pinned staging + async upload: the H2D copy of this batch runs
+            # on a side stream so it overlaps whatever the default stream is
+            # still finishing, instead of a synchronous pageable copy inside
+            # ultralytics' preprocess.
+            batch, scales = self._preprocess_batch(frames)
+            results = self.model.track(batch, persist=True, tracker="bytetrack.yaml",
+                                       conf=self.conf_thres, half=self.half, verbose=False)
+        else:
+            smalls = []
+            scales = []
+            for frame in frames:
+                small, scale = self._shrink(frame)
+                smalls.append(small)
+                scales.append(scale)
+
+            results = self.model.track(smalls, persist=True, tracker="bytetrack.yaml",
+                                       conf=self.conf_thres, half=self.half, verbose=False)
+
+        batch_detections = []
+
+        for r, scale in zip(results, scales):
+            batch_detections.append(self._extract(r, scale))
+
+        return batch_detections
+
+    def _preprocess_batch(self, frames):
+        """
+        Letterboxes a batch of BGR frames into a pinned staging tensor and
+        uploads it with a non-blocking copy on a dedicated CUDA stream.
+
+        Pinned (page-locked) memory is what lets cudaMemcpyAsync actually
+        run asynchronously; pageable numpy buffers force a staging copy and
+        a sync. Frames are anchored at the top-left of the 114-gray square
+        canvas, so mapping boxes back to source coords is a plain divide by
+        the per-frame scale (no pad offsets).
+
+        Returns (BxCx640x640 float tensor on the GPU, list of scales).
+        """
+        b = len(frames)
+        if self._pinned is None or self._pinned.shape[0] < b:
+            self._pinned = torch.empty((b, 3, self.imgsz, self.imgsz),
+                                       dtype=torch.float32, pin_memory=True)
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream()
+
+        scales = []
+        for i, frame in enumerate(frames):
+            h, w = frame.shape[:2]
+            scale = min(self.imgsz / h, self.imgsz / w)
+            nh, nw = int(round(h * scale)), int(round(w * scale))
+            canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+            canvas[:nh, :nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+            # BGR->RGB, HWC->CHW, [0,1] — straight into the pinned slot
+            chw = torch.from_numpy(np.ascontiguousarray(canvas[:, :, ::-1])).permute(2, 0, 1)
+            self._pinned[i].copy_(chw.float().div_(255.0))
+            scales.append(scale)
+
+        with torch.cuda.stream(self._copy_stream):
+            gpu = self._pinned[:b].to(self.device, non_blocking=True)
+        # Inference (default stream) must wait for the upload, but the CPU
+        # doesn't block here
+        torch.cuda.current_stream().wait_stream(self._copy_stream)
+        if self.half:
+            gpu = gpu.half()
+        return gpu, scales
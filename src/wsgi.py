@@ -0,0 +1,25 @@
+"""
+Production entry point.
+
+The Werkzeug dev server (app.run) spawns an OS thread per client and, with
+debug on, wastes CPU in the auto-reloader stat loop — a poor fit for
+long-lived /video_feed MJPEG generators. Serve with:
+
+    gunicorn -k gevent -w 1 -b 0.0.0.0:5000 wsgi:app
+
+Exactly one worker so the camera/detector singleton (and the GPU context)
+is initialized once; gevent greenlets then handle many concurrent viewers
+without thread-per-client overhead.
+"""
+from gevent import monkey
+
+# Patch before app (and therefore cv2/torch) gets imported so sockets
+# cooperate with the greenlet scheduler. thread=False is essential: the
+# camera's reader/inference/encoder threads must stay real OS threads,
+# because VideoCapture.read(), model.track() and imencode are blocking C
+# calls that never yield to the gevent hub — as greenlets they would
+# serialize the pipeline and stall every viewer for the length of each
+# inference call. As OS threads they release the GIL and overlap fine.
+monkey.patch_all(thread=False, subprocess=True)
+
+from app import app  # noqa: E402,F401